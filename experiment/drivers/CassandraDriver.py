@@ -1,14 +1,21 @@
 import logging
+import os
+import shlex
 import shutil
+import threading
 import time
+from functools import cached_property
 from pathlib import Path
 from typing import Optional, Union
 
 import enoslib as en
+from enoslib.api import Results
 
 from .util import build_yaml
 from .Driver import Driver
 
+NODETOOL_SEPARATOR = "__nodetool__"
+
 
 class MissingHostsException(Exception):
     pass
@@ -20,7 +27,43 @@ class InvalidSeedCountException(Exception):
 
 class CassandraDriver(Driver):
     CONTAINER_NAME = "cassandra"
-    DELAY_IN_SECONDS = 120
+    START_TIMEOUT_IN_SECONDS = 600
+    PROBE_INTERVAL_IN_SECONDS = 5
+    NATIVE_TRANSPORT_PORT = 9042
+    WAIT_TASK_NAME = "Wait for Cassandra"
+    COMPACTIONS_TASK_NAME = "Wait for compactions"
+
+    # Remote paths are the same for every host
+    CONF_DIR = "conf"
+    REMOTE_ROOT_PATH = "/root/cassandra"
+    REMOTE_CONF_PATH = f"{REMOTE_ROOT_PATH}/{CONF_DIR}"
+    # Warning: make sure there is enough space on disk
+    REMOTE_DATA_PATH = "/tmp/storage-data"
+    REMOTE_LOG_PATH = "/tmp/storage-log/log"
+    REMOTE_METRICS_PATH = "/tmp/metrics-data/metrics"
+    REMOTE_CONTAINER_CONF_PATH = "/etc/cassandra"
+    REMOTE_CONTAINER_DATA_PATH = "/var/lib/cassandra"
+    REMOTE_CONTAINER_LOG_PATH = "/var/log/cassandra"
+    REMOTE_CONTAINER_METRICS_PATH = "/metrics"
+
+    # Bind mounts of the Cassandra container
+    MOUNTS = [dict(source=source, target=target, type="bind") for source, target in [
+        (f"{REMOTE_CONF_PATH}/cassandra.yaml", f"{REMOTE_CONTAINER_CONF_PATH}/cassandra.yaml"),
+        (f"{REMOTE_CONF_PATH}/jvm-server.options", f"{REMOTE_CONTAINER_CONF_PATH}/jvm-server.options"),
+        (f"{REMOTE_CONF_PATH}/jvm11-server.options", f"{REMOTE_CONTAINER_CONF_PATH}/jvm11-server.options"),
+        (f"{REMOTE_CONF_PATH}/metrics-reporter-config.yaml",
+         f"{REMOTE_CONTAINER_CONF_PATH}/metrics-reporter-config.yaml"),
+        (REMOTE_DATA_PATH, REMOTE_CONTAINER_DATA_PATH),
+        (REMOTE_LOG_PATH, REMOTE_CONTAINER_LOG_PATH),
+        (REMOTE_METRICS_PATH, REMOTE_CONTAINER_METRICS_PATH)
+    ]]
+
+    ULIMITS = [
+        "memlock:-1:-1",
+        "nofile:100000:100000",
+        "nproc:32768:32768",
+        "as:-1:-1"
+    ]
 
     def __init__(self, docker_image: str):
         super().__init__()
@@ -30,55 +73,51 @@ class CassandraDriver(Driver):
 
         self.seeds: Optional[list[en.Host]] = None
         self.not_seeds: Optional[list[en.Host]] = None
+        self._seed_count = 0
+        self._not_seed_count = 0
+
+    @property
+    def local_config_template_path(self):
+        return self.local_global_root_path / "cassandra.yaml.j2"
 
     @property
     def seed_count(self):
-        return len(self.seeds) if self.seeds is not None else 0
+        return self._seed_count
 
     @property
     def not_seed_count(self):
-        return len(self.not_seeds) if self.not_seeds is not None else 0
+        return self._not_seed_count
+
+    @cached_property
+    def seed_addresses(self):
+        return ",".join(self.iter_host_addresses(hosts=self.seeds, port=7000))
 
     def set_seeds(self, seeds: list[en.Host]):
         self.seeds = seeds
+        self._seed_count = len(seeds)
+
+        # Invalidate cached seed addresses
+        self.__dict__.pop("seed_addresses", None)
 
     def set_not_seeds(self, not_seeds: list[en.Host]):
         self.not_seeds = not_seeds
+        self._not_seed_count = len(not_seeds)
 
     def get_host_address(self, index: int):
         return self.hosts[index].address
 
     def get_host_addresses(self, hosts=None, port=0):
-        return ",".join(self.host_addresses(hosts=hosts, port=port))
+        return ",".join(self.iter_host_addresses(hosts=hosts, port=port))
 
-    def build_file_tree(self, conf_dir="conf"):
+    def build_file_tree(self):
+        # Only local paths are host-specific; remote paths are class constants
         for host in self.hosts:
             local_root_path = self.local_global_root_path / host.address
 
-            local_conf_path = local_root_path / conf_dir
+            local_conf_path = local_root_path / CassandraDriver.CONF_DIR
             local_conf_path.mkdir(parents=True, exist_ok=True)
 
-            host.extra.update(local_root_path=str(local_root_path))
-            host.extra.update(local_conf_path=str(local_conf_path))
-
-            remote_root_path = "/root/cassandra"
-            remote_conf_path = f"{remote_root_path}/{conf_dir}"
-
-            # Warning: make sure there is enough space on disk
-            remote_data_path = "/tmp/storage-data"
-            remote_log_path = "/tmp/storage-log/log"
-            remote_metrics_path = "/tmp/metrics-data/metrics"
-
-            host.extra.update(remote_root_path=remote_root_path)
-            host.extra.update(remote_conf_path=remote_conf_path)
-            host.extra.update(remote_data_path=remote_data_path)
-            host.extra.update(remote_log_path=remote_log_path)
-            host.extra.update(remote_metrics_path=remote_metrics_path)
-
-            host.extra.update(remote_container_conf_path="/etc/cassandra")
-            host.extra.update(remote_container_data_path="/var/lib/cassandra")
-            host.extra.update(remote_container_log_path="/var/log/cassandra")
-            host.extra.update(remote_container_metrics_path="/metrics")
+            host.extra.update(local_root_path=str(local_root_path), local_conf_path=str(local_conf_path))
 
     def init(self, hosts: list[en.Host], seed_count=1, reset=False):
         if len(hosts) <= 0:
@@ -105,30 +144,45 @@ class CassandraDriver(Driver):
     def reset_data(self):
         with en.actions(roles=self.hosts) as actions:
             # Remove existing data
-            actions.file(path="{{remote_data_path}}", state="absent")
+            actions.file(path=CassandraDriver.REMOTE_DATA_PATH, state="absent")
 
     def create_config(self, template_path: Union[str, Path]):
-        seed_addresses = ",".join(self.host_addresses(hosts=self.seeds, port=7000))
+        """
+        Create the cassandra.yaml configuration shared by all hosts.
 
-        for host in self.hosts:
-            local_conf_path = host.extra["local_conf_path"]
+        The template is rendered once, with host-specific addresses left as Jinja
+        variables; Ansible fills them in for each host when deploying.
+        """
 
-            build_yaml(template_path=template_path,
-                       output_path=Path(local_conf_path, "cassandra.yaml"),
-                       update_spec={
-                           "seed_provider": {0: {"parameters": {0: {"seeds": seed_addresses}}}},
-                           "listen_address": host.address,
-                           "rpc_address": host.address
-                       })
+        build_yaml(template_path=template_path,
+                   output_path=self.local_config_template_path,
+                   update_spec={
+                       "seed_provider": {0: {"parameters": {0: {"seeds": self.seed_addresses}}}},
+                       "listen_address": "{{cassandra_address}}",
+                       "rpc_address": "{{cassandra_address}}"
+                   })
+
+        for host in self.hosts:
+            host.extra.update(cassandra_address=host.address)
 
         return self
 
     def create_extra_config(self, template_paths: list[Union[str, Path]]):
-        for host in self.hosts:
-            local_conf_path = host.extra["local_conf_path"]
+        # Templates are identical for every host: write each of them once, then hard-link it into the other hosts'
+        # configuration directories (rsync copies the content anyway)
+        for template_path in template_paths:
+            template_path = Path(template_path)
+
+            first_path, *other_paths = [Path(host.extra["local_conf_path"], template_path.name) for host in self.hosts]
+            shutil.copyfile(template_path, first_path)
 
-            for template_path in template_paths:
-                shutil.copy(template_path, local_conf_path)
+            for path in other_paths:
+                path.unlink(missing_ok=True)
+
+                try:
+                    os.link(first_path, path)
+                except OSError:
+                    shutil.copyfile(first_path, path)
 
         return self
 
@@ -142,20 +196,26 @@ class CassandraDriver(Driver):
         2. Create Cassandra containers.
         """
 
-        with en.actions(roles=self.hosts) as actions:
-            actions.file(path="{{remote_root_path}}", state="directory")
-            actions.file(path="{{remote_data_path}}", state="directory", mode="777")
-            actions.file(path="{{remote_log_path}}", state="directory", mode="777")
-            actions.file(path="{{remote_metrics_path}}", state="directory", mode="777")
+        # Tasks are independent between hosts: let each host go through them at its own pace
+        with en.actions(roles=self.hosts, strategy="free") as actions:
+            actions.file(path=CassandraDriver.REMOTE_ROOT_PATH, state="directory")
+            actions.file(path="{{item}}", state="directory", mode="777",
+                         loop=[CassandraDriver.REMOTE_DATA_PATH, CassandraDriver.REMOTE_LOG_PATH,
+                               CassandraDriver.REMOTE_METRICS_PATH])
 
-            # Transfer files
-            actions.copy(src="{{local_root_path}}/", dest="{{remote_root_path}}")
+            # Transfer files in a single rsync stream rather than one copy per file
+            actions.synchronize(src="{{local_root_path}}/", dest=CassandraDriver.REMOTE_ROOT_PATH, mode="push",
+                                rsync_opts=["--whole-file", "--inplace"])
 
-            # Disable the swap memory
-            actions.shell(cmd="swapoff --all")
+            # Render the host-specific cassandra.yaml
+            actions.template(src=str(self.local_config_template_path),
+                             dest=f"{CassandraDriver.REMOTE_CONF_PATH}/cassandra.yaml")
 
-            # Increase number of memory map areas
-            actions.sysctl(name="vm.max_map_count", value="1048575")
+            # Disable the swap memory and increase number of memory map areas
+            actions.shell(cmd="swapoff --all && sysctl -w vm.max_map_count=1048575")
+
+            # Pull the image explicitly; an image that is already present is not pulled again (no registry access)
+            actions.docker_image(name=self.docker_image, source="pull", state="present", force_source=False)
 
             # Create Cassandra container (without running)
             actions.docker_container(name=CassandraDriver.CONTAINER_NAME,
@@ -163,49 +223,8 @@ class CassandraDriver(Driver):
                                      state="present",
                                      detach="yes",
                                      network_mode="host",
-                                     mounts=[
-                                         {
-                                             "source": "{{remote_conf_path}}/cassandra.yaml",
-                                             "target": "{{remote_container_conf_path}}/cassandra.yaml",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_conf_path}}/jvm-server.options",
-                                             "target": "{{remote_container_conf_path}}/jvm-server.options",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_conf_path}}/jvm11-server.options",
-                                             "target": "{{remote_container_conf_path}}/jvm11-server.options",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_conf_path}}/metrics-reporter-config.yaml",
-                                             "target": "{{remote_container_conf_path}}/metrics-reporter-config.yaml",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_data_path}}",
-                                             "target": "{{remote_container_data_path}}",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_log_path}}",
-                                             "target": "{{remote_container_log_path}}",
-                                             "type": "bind"
-                                         },
-                                         {
-                                             "source": "{{remote_metrics_path}}",
-                                             "target": "{{remote_container_metrics_path}}",
-                                             "type": "bind"
-                                         }
-                                     ],
-                                     ulimits=[
-                                         "memlock:-1:-1",
-                                         "nofile:100000:100000",
-                                         "nproc:32768:32768",
-                                         "as:-1:-1"
-                                     ])
+                                     mounts=CassandraDriver.MOUNTS,
+                                     ulimits=CassandraDriver.ULIMITS)
 
         logging.info(f"Cassandra has been deployed "
                      f"(hosts={self.host_addresses()}, seeds={self.host_addresses(hosts=self.seeds)}).")
@@ -216,9 +235,12 @@ class CassandraDriver(Driver):
         """
         Run a Cassandra cluster.
 
-        Note that running Cassandra should be done one node at a time;
-        this is due to the bootstrapping process which may generate
-        collisions when two nodes are starting at the same time.
+        Seeds do not bootstrap, so they are all started at once. The other nodes
+        are then started one at a time; this is due to the bootstrapping process
+        which may generate collisions when two nodes are starting at the same time.
+
+        Each node waits on itself until it is ready to serve clients, so the whole
+        cluster starts in two plays (the second one processes one host at a time).
 
         For more details, see:
 
@@ -226,18 +248,56 @@ class CassandraDriver(Driver):
         - https://thelastpickle.com/blog/2017/05/23/auto-bootstrapping-part1.html
         """
 
-        for index, host in enumerate(self.hosts):
-            with en.actions(roles=host) as actions:
-                actions.docker_container(name=CassandraDriver.CONTAINER_NAME, state="started")
+        started_count, host_count = 0, self.host_count
+        for hosts, serial in [(self.seeds, None), (self.not_seeds, 1)]:
+            if hosts is None:
+                continue
+
+            results = self.start_and_wait(hosts, serial=serial)
 
-            # Make sure to wait at least 2 minutes for bootstrapping to finish
-            time.sleep(CassandraDriver.DELAY_IN_SECONDS)
+            for result in results.filter(task=CassandraDriver.WAIT_TASK_NAME):
+                if result.payload.get("failed"):
+                    logging.warning(f"[{result.host}] Cassandra is still not ready after "
+                                    f"{CassandraDriver.START_TIMEOUT_IN_SECONDS} seconds.")
+                else:
+                    started_count += 1
 
-            logging.info(f"[{host.address}] Cassandra is up and running "
-                         f"({index + 1}/{self.host_count}).")
+                    logging.info(f"[{result.host}] Cassandra is up and running ({started_count}/{host_count}).")
 
         return self
 
+    def start_and_wait(self, hosts: list[en.Host], serial: Optional[int] = None) -> Results:
+        """
+        Start Cassandra containers, then wait until nodes accept client connections.
+
+        The native transport only starts once a node has joined the ring, so a
+        listening native transport port means bootstrapping is over. The port is
+        polled by Ansible on the nodes themselves; nodes that are still not ready
+        after `START_TIMEOUT_IN_SECONDS` are reported but do not abort the play.
+        """
+
+        play_source = dict(hosts="all", gather_facts=False, tasks=[
+            {
+                "name": "Start Cassandra",
+                "docker_container": {"name": CassandraDriver.CONTAINER_NAME, "state": "started"}
+            },
+            {
+                "name": CassandraDriver.WAIT_TASK_NAME,
+                "wait_for": {
+                    "host": "{{cassandra_address}}",
+                    "port": CassandraDriver.NATIVE_TRANSPORT_PORT,
+                    "sleep": CassandraDriver.PROBE_INTERVAL_IN_SECONDS,
+                    "timeout": CassandraDriver.START_TIMEOUT_IN_SECONDS
+                },
+                "ignore_errors": True
+            }
+        ])
+
+        if serial is not None:
+            play_source["serial"] = serial
+
+        return en.run_play(play_source, roles=hosts)
+
     def destroy(self):
         """
         Destroy a Cassandra instance.
@@ -245,35 +305,39 @@ class CassandraDriver(Driver):
         1. Stop and remove the Cassandra Docker container.
         2. Remove Cassandra configuration files, logs, caches and metrics.
         3. Drop OS caches.
+
+        Everything runs as a single shell task on each host.
         """
 
-        with en.actions(roles=self.hosts) as actions:
+        cmds = [
             # Stop and remove container
-            actions.docker_container(name=CassandraDriver.CONTAINER_NAME, state="absent")
-
-            # Remove Cassandra files
-            actions.file(path="{{remote_root_path}}", state="absent")
-
-            # Remove Cassandra logs
-            actions.file(path="{{remote_log_path}}", state="absent")
+            f"(docker rm --force {CassandraDriver.CONTAINER_NAME} || true)",
+            # Remove Cassandra files, logs, caches and metrics
+            f"rm -rf {CassandraDriver.REMOTE_ROOT_PATH} {CassandraDriver.REMOTE_LOG_PATH} "
+            f"{CassandraDriver.REMOTE_DATA_PATH}/saved_caches {CassandraDriver.REMOTE_DATA_PATH}/hints "
+            f"{CassandraDriver.REMOTE_METRICS_PATH}",
+            # Write dirty pages back to disk, so that dropping OS caches actually frees them
+            "sync",
+            # Drop OS caches
+            "echo 3 > /proc/sys/vm/drop_caches"
+        ]
 
-            # Remove Cassandra caches
-            actions.file(path="{{remote_data_path}}/saved_caches", state="absent")
-            actions.file(path="{{remote_data_path}}/hints", state="absent")
+        with en.actions(roles=self.hosts) as actions:
+            actions.shell(cmd=" && ".join(cmds))
 
-            # Remove Cassandra metrics
-            actions.file(path="{{remote_metrics_path}}", state="absent")
+        return self
 
-            # Wait some time to be sure that files are not needed anymore by page cache
-            time.sleep(10)
+    def cleanup(self):
+        """
+        Remove the local configuration files.
 
-            # Drop OS caches
-            actions.shell(cmd="echo 3 > /proc/sys/vm/drop_caches")
+        The directory is renamed first, so that it is out of the way at once, then deleted in a background thread.
+        """
 
-        return self
+        trash_path = self.local_global_root_path.with_name(f"{self.local_global_root_path.name}.trash-{time.time_ns()}")
+        self.local_global_root_path.rename(trash_path)
 
-    def cleanup(self):
-        shutil.rmtree(self.local_global_root_path)
+        threading.Thread(target=shutil.rmtree, args=(trash_path,), kwargs=dict(ignore_errors=True)).start()
 
         return self
 
@@ -291,6 +355,42 @@ class CassandraDriver(Driver):
 
         return results
 
+    def nodetool_batch(self, commands: dict[en.Host, list[str]]) -> dict[en.Host, dict[str, str]]:
+        """
+        Execute per-host lists of nodetool commands on Cassandra nodes in a single play.
+
+        Each host gets its own command line through a task variable keyed by host; all its
+        commands run within a single `docker exec`. Outputs are delimited by a separator line,
+        then split back per command.
+        """
+
+        nodetool_cmds = {}
+        for host, host_commands in commands.items():
+            script = " && ".join(f"echo {NODETOOL_SEPARATOR} && nodetool {command}" for command in host_commands)
+            nodetool_cmds[host.alias] = f"docker exec {CassandraDriver.CONTAINER_NAME} sh -c {shlex.quote(script)}"
+
+        with en.actions(roles=list(commands.keys())) as actions:
+            actions.shell(cmd="{{nodetool_cmds[inventory_hostname]}}", vars={"nodetool_cmds": nodetool_cmds})
+            results = actions.results
+
+        outputs = {}
+        for host, host_commands in commands.items():
+            stdout = results.filter(host=host.alias)[0].payload["stdout"]
+            host_outputs = stdout.split(f"{NODETOOL_SEPARATOR}\n")[1:]
+            outputs[host] = {command: output.rstrip("\n") for command, output in zip(host_commands, host_outputs)}
+
+        return outputs
+
+    def nodetool_many(self, commands: list[str], host: Optional[en.Host] = None) -> dict[str, str]:
+        """
+        Execute several nodetool commands on a Cassandra node in a single play.
+        """
+
+        if host is None:
+            host = self.hosts[0]
+
+        return self.nodetool_batch({host: commands})[host]
+
     def flush(self, keyspace: str, table: str):
         """
         Flush memtable to disk on each host.
@@ -306,20 +406,51 @@ class CassandraDriver(Driver):
         results = self.nodetool(f"tablestats {keyspace}.{table}", [self.hosts[0]])
         return results[0].payload["stdout"]
 
-    def pull_log(self, basepath: Path):
-        for host in self.hosts:
-            local_path = basepath / host.address
-            local_path.mkdir(parents=True, exist_ok=True)
+    def diagnostics(self, keyspace: str, table: str):
+        """
+        Fetch both the cluster status and the table statistics in one round-trip.
+        """
 
-            host.extra.update(local_path=str(local_path))
+        outputs = self.nodetool_many(["status", f"tablestats {keyspace}.{table}"])
+        return "\n".join(outputs.values())
 
-        self.pull(dest="{{local_path}}", src="{{remote_log_path}}")
+    def wait_for_compactions(self, timeout: int):
+        """
+        Wait until no compaction is pending or running on any node, for at most `timeout` seconds.
 
-    def pull_metrics(self, basepath: Path):
-        for host in self.hosts:
-            local_path = basepath / host.address
-            local_path.mkdir(parents=True, exist_ok=True)
+        The pending tasks count is only an estimate, which can already be 0 while a compaction is
+        still running: a node is done once it also lists no active compaction (the table of active
+        compactions, and its header, is only printed when there is one).
+
+        `nodetool compactionstats` is polled by Ansible on the nodes themselves; nodes that are
+        still compacting after `timeout` seconds are reported but do not abort the play.
+        """
+
+        with en.actions(roles=self.hosts) as actions:
+            actions.add_task({
+                "name": CassandraDriver.COMPACTIONS_TASK_NAME,
+                "shell": f"docker exec {CassandraDriver.CONTAINER_NAME} nodetool compactionstats",
+                "register": "compactionstats",
+                "until": "'pending tasks: 0' in compactionstats.stdout and "
+                         "'compaction type' not in compactionstats.stdout",
+                "retries": max(timeout // CassandraDriver.PROBE_INTERVAL_IN_SECONDS, 1),
+                "delay": CassandraDriver.PROBE_INTERVAL_IN_SECONDS,
+                "ignore_errors": True
+            })
+            results = actions.results
+
+        for result in results.filter(task=CassandraDriver.COMPACTIONS_TASK_NAME):
+            if result.payload.get("failed"):
+                logging.warning(f"[{result.host}] Compactions are still pending or running after {timeout} seconds.")
+
+        return self
 
-            host.extra.update(local_path=str(local_path))
+    def pull_log(self, basepath: Path):
+        self.create_local_host_paths(basepath, "local_path")
+
+        self.pull(dest="{{local_path}}", src=CassandraDriver.REMOTE_LOG_PATH)
+
+    def pull_metrics(self, basepath: Path):
+        self.create_local_host_paths(basepath, "local_path")
 
-        self.pull(dest="{{local_path}}", src="{{remote_metrics_path}}")
+        self.pull(dest="{{local_path}}", src=CassandraDriver.REMOTE_METRICS_PATH)
@@ -1,3 +1,7 @@
+import logging
+import shlex
+import subprocess
+from pathlib import Path
 from typing import Optional, Union
 
 import enoslib as en
@@ -13,28 +17,46 @@ class MissingFileTreeException(Exception):
     pass
 
 
+class PullFailedException(Exception):
+    pass
+
+
 class Driver:
+    # Results are written once to a fresh directory: write them in place, and keep partial files if interrupted
+    PULL_RSYNC_OPTS = ["--inplace", "--partial"]
+
     def __init__(self):
         self.filetrees: dict[str, FileTree] = {}
         self.mount_points: dict[str, dict] = {}
         self.hosts: Optional[list[en.Host]] = None
+        self._host_count = 0
 
     @property
     def host_count(self):
-        return len(self.hosts) if self.hosts is not None else 0
+        return self._host_count
 
     def set_hosts(self, hosts: list[en.Host]):
         if len(hosts) <= 0:
             raise MissingHostsException
 
         self.hosts = hosts
+        self._host_count = len(hosts)
+
+    def iter_host_addresses(self, hosts: Optional[list[en.Host]] = None, port=0):
+        """
+        Lazily yield host addresses, suffixed with `port` when given.
+        """
 
-    def host_addresses(self, hosts: Optional[list[en.Host]] = None, port=0):
         if hosts is None:
             hosts = self.hosts
 
-        _port = f":{port}" if port > 0 else ""
-        return [f"{host.address}{_port}" for host in hosts]
+        if port <= 0:
+            return (host.address for host in hosts)
+
+        return (f"{host.address}:{port}" for host in hosts)
+
+    def host_addresses(self, hosts: Optional[list[en.Host]] = None, port=0):
+        return list(self.iter_host_addresses(hosts=hosts, port=port))
 
     def create_filetree(self, key: str, spec: list[dict]):
         filetree = FileTree().define(spec)
@@ -61,6 +83,21 @@ class Driver:
     def mounts(self):
         return list(self.mount_points.values())
 
+    def create_local_host_paths(self, basepath: Path, key: str):
+        """
+        Create one local directory per host under `basepath`, and store its path in `host.extra[key]`.
+
+        Parents are only created once, for `basepath`.
+        """
+
+        basepath.mkdir(parents=True, exist_ok=True)
+
+        for host in self.hosts:
+            local_path = basepath / host.address
+            local_path.mkdir(exist_ok=True)
+
+            host.extra[key] = str(local_path)
+
     def push(self, src: str,
              dest: str,
              src_hosts: Optional[list[Union[None, en.Host]]] = None,
@@ -74,14 +111,73 @@ class Driver:
         if dest_hosts is None:
             dest_hosts = self.hosts
 
-        for src_host in src_hosts:
-            args = dict(src=src, dest=dest, mode="push")
-            if isinstance(src_host, en.Host):
-                args["delegate_to"] = src_host.address
+        # A single play for all source hosts; each destination host still syncs in parallel
+        with en.actions(roles=dest_hosts) as actions:
+            for src_host in src_hosts:
+                args = dict(src=src, dest=dest, mode="push")
+                if isinstance(src_host, en.Host):
+                    args["delegate_to"] = src_host.address
 
-            with en.actions(roles=dest_hosts) as actions:
                 actions.synchronize(**args)
 
+    @staticmethod
+    def ssh_command(host: en.Host):
+        """
+        Build the ssh command used to reach `host` from the controller, the way EnOSlib builds its Ansible inventory
+        (port, private key, gateway). Batch mode makes ssh fail rather than prompt for a password or passphrase.
+        """
+
+        args = ["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", "-o", "BatchMode=yes"]
+
+        if host.port is not None:
+            args.extend(["-p", str(host.port)])
+        if host.keyfile is not None:
+            args.extend(["-i", str(host.keyfile)])
+        if host.extra.get("forward_agent", False):
+            args.extend(["-o", "ForwardAgent=yes"])
+
+        gateway = host.extra.get("gateway")
+        if gateway is not None:
+            proxy_args = ["ssh", "-W", "%h:%p", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null",
+                          "-o", "BatchMode=yes"]
+
+            gateway_user = host.extra.get("gateway_user", host.user)
+            if gateway_user is not None:
+                proxy_args.extend(["-l", gateway_user])
+
+            proxy_args.append(gateway)
+            args.extend(["-o", f"ProxyCommand={shlex.join(proxy_args)}"])
+
+        return shlex.join(args)
+
+    def pull_direct(self, src: str, dest_key: str, src_hosts: Optional[list[en.Host]] = None):
+        """
+        Pull files from `src` on `src_hosts` to the local directory stored in `host.extra[dest_key]`.
+
+        Contrary to `pull`, this bypasses Ansible: one rsync process is spawned per host, and
+        all of them run in parallel. Hosts are reached with the same ssh settings as Ansible.
+        """
+
+        if src_hosts is None:
+            src_hosts = self.hosts
+
+        processes = []
+        for host in src_hosts:
+            remote = f"{host.user}@{host.address}" if host.user is not None else host.address
+            args = ["rsync", "--archive", "--compress", *Driver.PULL_RSYNC_OPTS,
+                    "--rsh", Driver.ssh_command(host), f"{remote}:{src}", host.extra[dest_key]]
+
+            processes.append((host, subprocess.Popen(args)))
+
+        failed_hosts = []
+        for host, process in processes:
+            if process.wait() != 0:
+                logging.error(f"[{host.address}] rsync exited with code {process.returncode}.")
+                failed_hosts.append(host)
+
+        if len(failed_hosts) > 0:
+            raise PullFailedException(f"Results could not be pulled from {[host.address for host in failed_hosts]}.")
+
     def pull(self, dest: str,
              src: str,
              dest_hosts: Optional[list[Union[None, en.Host]]] = None,
@@ -95,10 +191,11 @@ class Driver:
         if src_hosts is None:
             src_hosts = self.hosts
 
-        for dest_host in dest_hosts:
-            args = dict(src=src, dest=dest, mode="pull")
-            if isinstance(dest_host, en.Host):
-                args["delegate_to"] = dest_host.address
+        # A single play for all destination hosts; each source host still syncs in parallel
+        with en.actions(roles=src_hosts) as actions:
+            for dest_host in dest_hosts:
+                args = dict(src=src, dest=dest, mode="pull", compress=True, rsync_opts=Driver.PULL_RSYNC_OPTS)
+                if isinstance(dest_host, en.Host):
+                    args["delegate_to"] = dest_host.address
 
-            with en.actions(roles=src_hosts) as actions:
                 actions.synchronize(**args)
@@ -1,6 +1,10 @@
+import json
 import logging
+import shlex
+import tarfile
+import tempfile
 from pathlib import Path
-from typing import Optional, Union
+from typing import Iterable, Optional, Union
 
 import enoslib as en
 
@@ -8,32 +12,52 @@ from .Driver import Driver
 
 
 class Command:
+    __slots__ = ("tokens", "_str")
+
     def __init__(self):
         self.tokens = []
+        # Joined tokens, reset whenever a token is added
+        self._str: Optional[str] = None
 
     def token(self, token: str):
         self.tokens.append(token)
+        self._str = None
+
+        return self
+
+    def extend(self, tokens: Iterable[str]):
+        self.tokens.extend(tokens)
+        self._str = None
 
         return self
 
+    def write(self, buf: list[str]):
+        buf.extend(self.tokens)
+
+        return buf
+
     def __str__(self):
-        return " ".join(self.tokens)
+        if self._str is None:
+            self._str = " ".join(self.tokens)
+
+        return self._str
 
 
 class ParameterizedCommand(Command):
+    __slots__ = ()
+
     def parameter(self, key, value):
         self.token(f"{key}={value}")
 
         return self
 
     def parameters(self, **kwargs):
-        for key in kwargs:
-            self.parameter(key, kwargs[key])
-
-        return self
+        return self.extend(f"{key}={value}" for key, value in kwargs.items())
 
 
 class RunCommand(ParameterizedCommand):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.token("run")
@@ -44,6 +68,8 @@ class RunCommand(ParameterizedCommand):
 
 
 class StartCommand(ParameterizedCommand):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.token("start")
@@ -54,6 +80,8 @@ class StartCommand(ParameterizedCommand):
 
 
 class AwaitCommand(Command):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.token("await")
@@ -64,6 +92,8 @@ class AwaitCommand(Command):
 
 
 class StopCommand(Command):
+    __slots__ = ()
+
     def __init__(self):
         super().__init__()
         self.token("stop")
@@ -88,8 +118,7 @@ class Scenario:
         return self
 
     def arg(self, name, value):
-        self.args.append(name)
-        self.args.append(str(value))
+        self.args.extend((name, str(value)))
 
         return self
 
@@ -139,10 +168,14 @@ class Scenario:
         return self
 
     def __str__(self):
-        cmds = " ".join((str(cmd) for cmd in self.cmds))
-        args = " ".join(self.args)
+        # Tokens of every command and arguments are joined at once, without intermediate strings
+        buf = []
+        for cmd in self.cmds:
+            cmd.write(buf)
+
+        buf.extend(self.args)
 
-        return cmds + " " + args
+        return " ".join(buf)
 
     def as_string(self):
         return str(self)
@@ -150,22 +183,37 @@ class Scenario:
 
 class NBDriver(Driver):
     CONTAINER_NAME = "nb"
+    PULL_TIMEOUT_IN_SECONDS = 600
+    PULL_POLL_INTERVAL_IN_SECONDS = 2
+    INSPECT_TASK_NAME = "Inspect NoSQLBench image"
 
     def __init__(self, docker_image: str):
         super().__init__()
 
         self.docker_image = docker_image
+        self.mount_args = ""
+        # Image entrypoint, through which commands are executed in the long-running container
+        self.entrypoint_args = ""
+
+    def deploy(self, hosts: list[en.Host],
+               driver_config_paths: Optional[list[Path]] = None,
+               workload_config_paths: Optional[list[Path]] = None):
+        """
+        Deploy NoSQLBench on client hosts, along with its driver and workload configuration files.
+
+        Everything runs in a single play. The Docker image is pulled in the background while
+        directories are created and files are unpacked, then the play waits for the pull to end.
+        """
 
-    def deploy(self, hosts: list[en.Host]):
         self.set_hosts(hosts)
 
-        self.create_filetree("remote", [
+        remote_ft = self.create_filetree("remote", [
             {"path": "/root/nosqlbench", "tags": ["root"]},
             {"path": "@root/conf", "tags": ["conf"]},
             {"path": "@conf/driver", "tags": ["driver-conf"]},
             {"path": "@conf/workload", "tags": ["workload-conf"]},
             {"path": "@root/data", "tags": ["data"]}
-        ]).build(remote=self.hosts)
+        ])
 
         self.create_filetree("remote_container", [
             {"path": "/etc/nosqlbench", "tags": ["conf"]},
@@ -179,6 +227,10 @@ class NBDriver(Driver):
             ("data", "{{remote_data_path}}", "{{remote_container_data_path}}", "bind")
         ])
 
+        # Mounts do not change between commands: build the docker run arguments once
+        self.mount_args = " ".join(f"--mount type={mount['type']},source={mount['source']},target={mount['target']}"
+                                   for mount in self.mounts())
+
         extra_vars = {
             "remote_conf_path": str(self.filetree("remote").path("conf")),
             "remote_data_path": str(self.filetree("remote").path("data")),
@@ -189,27 +241,131 @@ class NBDriver(Driver):
         for host in self.hosts:
             host.extra.update(**extra_vars)
 
+        config_files = self.config_files(driver_config_paths, workload_config_paths)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive_path = self.create_config_archive(Path(tmp_dir), config_files)
+
+            with en.actions(roles=self.hosts) as actions:
+                # Pull the image now rather than within the first command (no-op if it is already present)
+                actions.add_task({
+                    "name": "Pull NoSQLBench image",
+                    "docker_image": {
+                        "name": self.docker_image,
+                        "source": "pull",
+                        "state": "present",
+                        "force_source": False
+                    },
+                    "async": NBDriver.PULL_TIMEOUT_IN_SECONDS,
+                    "poll": 0,
+                    "register": "pull_job"
+                })
+
+                actions.file(path="{{item}}", state="directory", mode=0o777,
+                             loop=[str(path) for path in remote_ft.leaves()])
+
+                if len(config_files) > 0:
+                    actions.unarchive(src=str(archive_path), dest=str(remote_ft.path("conf")))
+
+                actions.add_task({
+                    "name": "Wait for NoSQLBench image",
+                    "async_status": {"jid": "{{pull_job.ansible_job_id}}"},
+                    "register": "pull_result",
+                    "until": "pull_result.finished",
+                    "retries": NBDriver.PULL_TIMEOUT_IN_SECONDS // NBDriver.PULL_POLL_INTERVAL_IN_SECONDS,
+                    "delay": NBDriver.PULL_POLL_INTERVAL_IN_SECONDS
+                })
+
         logging.info(f"NoSQLBench has been deployed (hosts={self.host_addresses()}).")
 
+    def push_config(self, driver_config_paths: Optional[list[Path]] = None,
+                    workload_config_paths: Optional[list[Path]] = None):
+        """
+        Ship driver and workload configuration files to hosts on which NoSQLBench is already deployed.
+        """
+
+        config_files = self.config_files(driver_config_paths, workload_config_paths)
+        if len(config_files) <= 0:
+            return self
+
+        remote_ft = self.filetree("remote")
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive_path = self.create_config_archive(Path(tmp_dir), config_files)
+
+            with en.actions(roles=self.hosts) as actions:
+                actions.unarchive(src=str(archive_path), dest=str(remote_ft.path("conf")))
+
+        return self
+
+    @staticmethod
+    def config_files(driver_config_paths: Optional[list[Path]] = None,
+                     workload_config_paths: Optional[list[Path]] = None):
+        return [(path, "driver-conf") for path in driver_config_paths or []] + \
+               [(path, "workload-conf") for path in workload_config_paths or []]
+
+    def create_config_archive(self, basepath: Path, config_files: list[tuple[Path, str]]):
+        """
+        Bundle configuration files into a single archive laid out like the remote conf directory, so that they are
+        shipped and extracted by a single task.
+        """
+
+        remote_ft = self.filetree("remote")
+
+        archive_path = basepath / "nosqlbench-conf.tar.gz"
+        with tarfile.open(archive_path, "w:gz") as archive:
+            for path, tag in config_files:
+                archive.add(path, arcname=str(remote_ft.path(tag).relative_to(remote_ft.path("conf")) / path.name))
+
+        return archive_path
+
+    def start_daemon(self):
+        """
+        Start a long-running NoSQLBench container on each host, in which commands are then executed.
+
+        The container idles with `sleep`; commands are run through the image entrypoint with `docker exec`, which
+        saves a container creation and removal per command.
+        """
+
+        with en.actions(roles=self.hosts) as actions:
+            actions.shell(cmd=f"docker image inspect {self.docker_image}", task_name=NBDriver.INSPECT_TASK_NAME)
+            # A leftover container from an aborted run is removed first
+            actions.shell(cmd=f"(docker rm --force {NBDriver.CONTAINER_NAME} > /dev/null 2>&1 || true) && "
+                              f"docker run --detach --name {NBDriver.CONTAINER_NAME} --network host {self.mount_args} "
+                              f"--entrypoint sleep {self.docker_image} infinity")
+            results = actions.results
+
+        inspect_result = results.filter(host=self.hosts[0].alias, task=NBDriver.INSPECT_TASK_NAME)[0]
+        entrypoint = json.loads(inspect_result.payload["stdout"])[0]["Config"]["Entrypoint"]
+        self.entrypoint_args = shlex.join(entrypoint or [])
+
+        logging.info(f"NoSQLBench container is running (hosts={self.host_addresses()}).")
+
+        return self
+
+    def stop_daemon(self):
+        with en.actions(roles=self.hosts) as actions:
+            actions.shell(cmd=f"docker rm --force {NBDriver.CONTAINER_NAME} > /dev/null 2>&1 || true")
+
+        return self
+
     def destroy(self):
+        self.stop_daemon()
         self.filetree("remote").remove("root", remote=self.hosts)
 
     def commands(self, commands: list[tuple[en.Host, str]]):
-        hosts = []
+        # Per-host commands are passed as task variables keyed by host, so that `host.extra` is left untouched
+        host_commands = {}
         for host, command in commands:
-            host.extra.update(command=command)
-            hosts.append(host)
+            # Quote each argument, so that the shell passes them to NoSQLBench untouched
+            host_commands[host.alias] = shlex.join(shlex.split(command))
 
             logging.info(f"[{host.address}] Running command `{command}`.")
 
-        with en.actions(roles=hosts) as actions:
-            actions.docker_container(name=NBDriver.CONTAINER_NAME, image=self.docker_image, detach="no",
-                                     network_mode="host", mounts=self.mounts(), command="{{command}}")
-
-            actions.docker_container(name=NBDriver.CONTAINER_NAME, state="absent")
-
-        for host in hosts:
-            host.extra.update(command=None)
+        with en.actions(roles=[host for host, _ in commands]) as actions:
+            actions.shell(cmd=f"docker exec {NBDriver.CONTAINER_NAME} {self.entrypoint_args} "
+                              "{{host_commands[inventory_hostname]}}",
+                          vars={"host_commands": host_commands})
 
     def command(self, command: str, host: Optional[en.Host] = None):
         if host is None:
@@ -217,14 +373,24 @@ class NBDriver(Driver):
 
         self.commands([(host, command)])
 
-    def pull_results(self, basepath: Path):
-        for host in self.hosts:
-            local_data_path = basepath / host.address
-            local_data_path.mkdir(parents=True, exist_ok=True)
+    def pull_results(self, basepath: Path, direct=False):
+        """
+        Pull NoSQLBench results from client hosts, then clean up their data directory.
 
-            host.extra.update(local_data_path=str(local_data_path))
+        With `direct`, results are pulled with rsync processes spawned from the controller rather
+        than through Ansible.
+        """
 
-        self.pull(dest="{{local_data_path}}", src="{{remote_data_path}}")
+        self.create_local_host_paths(basepath, "local_data_path")
 
-        with en.actions(roles=self.hosts) as actions:
-            actions.shell(cmd="rm -rf {{remote_data_path}}/*")
+        if direct:
+            self.pull_direct(src=str(self.filetree("remote").path("data")), dest_key="local_data_path")
+
+            with en.actions(roles=self.hosts) as actions:
+                actions.shell(cmd="rm -rf {{remote_data_path}}/*")
+        else:
+            # Pull and clean up in the same play: each host is cleaned up as soon as its own results have been pulled
+            with en.actions(roles=self.hosts, strategy="free") as actions:
+                actions.synchronize(src="{{remote_data_path}}", dest="{{local_data_path}}", mode="pull", compress=True,
+                                    rsync_opts=Driver.PULL_RSYNC_OPTS)
+                actions.shell(cmd="rm -rf {{remote_data_path}}/*")
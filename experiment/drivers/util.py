@@ -1,19 +1,66 @@
+import copy
 import pathlib
 from typing import Union
 
 import yaml
 
+# Use the libyaml bindings when PyYAML has been built with them
+try:
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+
 
 def update_dict_from_spec(data: Union[dict, list], update_spec: dict):
     """
     Update a dict (or a list) according to a given update specification.
     """
 
-    for key in update_spec:
-        if isinstance(update_spec[key], dict):
-            update_dict_from_spec(data[key], update_spec[key])
-        else:
-            data[key] = update_spec[key]
+    stack = [(data, update_spec)]
+
+    while len(stack) > 0:
+        _data, _update_spec = stack.pop()
+
+        for key, value in _update_spec.items():
+            if isinstance(value, dict):
+                stack.append((_data[key], value))
+            else:
+                _data[key] = value
+
+
+# Parsed templates, keyed by path and modification time
+_TEMPLATE_CACHE: dict[tuple[str, int], dict] = {}
+
+
+def load_yaml(template_path: Union[str, pathlib.Path]) -> dict:
+    """
+    Load a YAML template file, so that it can be rendered several times.
+
+    Parsed templates are cached until the file is modified. The returned dict is
+    shared between calls, so it must not be mutated (`render_yaml` works on a copy).
+    """
+
+    template_path = pathlib.Path(template_path)
+    key = (str(template_path.resolve()), template_path.stat().st_mtime_ns)
+
+    if key not in _TEMPLATE_CACHE:
+        with template_path.open("rb") as template_file:
+            _TEMPLATE_CACHE[key] = yaml.load(template_file, Loader=SafeLoader)
+
+    return _TEMPLATE_CACHE[key]
+
+
+def render_yaml(template: dict, output_path: Union[str, pathlib.Path], update_spec: dict):
+    """
+    Update a copy of a loaded YAML template and write the result to a new YAML
+    file. The template itself is left untouched.
+    """
+
+    data = copy.deepcopy(template)
+    update_dict_from_spec(data, update_spec)
+
+    with pathlib.Path(output_path).open("w") as output_file:
+        yaml.dump(data, output_file, Dumper=SafeDumper)
 
 
 def build_yaml(template_path: Union[str, pathlib.Path], output_path: Union[str, pathlib.Path], update_spec: dict):
@@ -60,10 +107,4 @@ def build_yaml(template_path: Union[str, pathlib.Path], output_path: Union[str,
     Note that the other property `bar` has not been modified.
     """
 
-    with pathlib.Path(template_path).open("r") as template_file:
-        data = yaml.safe_load(template_file)
-
-    update_dict_from_spec(data, update_spec)
-
-    with pathlib.Path(output_path).open("w") as output_file:
-        yaml.dump(data, output_file)
+    render_yaml(load_yaml(template_path), output_path, update_spec)
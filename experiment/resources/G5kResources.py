@@ -1,3 +1,5 @@
+import hashlib
+import json
 import logging
 from pathlib import Path
 from typing import Optional
@@ -21,14 +23,18 @@ class UndefinedProviderException(Exception):
 class G5kResources:
     DEFAULT_BIND_VAR_DOCKER = "/tmp/docker"
     DEFAULT_DOCKER_REGISTRY = dict(type="external", ip="docker-cache.grid5000.fr", port=80)
+    DEFAULT_CACHE_PATH = ".cache"
 
     def __init__(self, site: str, cluster: str, settings: dict,
                  bind_var_docker: Optional[str] = None,
-                 docker_registry: Optional[dict] = None):
+                 docker_registry: Optional[dict] = None,
+                 cache_path: Optional[str] = None):
         if bind_var_docker is None:
             bind_var_docker = G5kResources.DEFAULT_BIND_VAR_DOCKER
         if docker_registry is None:
             docker_registry = G5kResources.DEFAULT_DOCKER_REGISTRY
+        if cache_path is None:
+            cache_path = G5kResources.DEFAULT_CACHE_PATH
 
         self.site = site
         self.cluster = cluster
@@ -38,6 +44,7 @@ class G5kResources:
 
         self.bind_var_docker = bind_var_docker
         self.docker_registry = docker_registry
+        self.cache_path = Path(cache_path)
 
         self.provider: Optional[en.G5k] = None
         self.roles: Optional[en.Roles] = None
@@ -90,27 +97,55 @@ class G5kResources:
         return 0
 
     def acquire(self, with_docker: Optional[str] = None):
+        """
+        Reserve the resources (EnOSlib reloads the existing job, if any) and
+        optionally install Docker on the nodes of a given role.
+
+        Docker installation is remembered on disk for the current job, so that
+        running experiments again within the same job skips it.
+        """
+
         self.provider = en.G5k(self.conf.finalize())
         self.roles, self.networks = self.provider.init()
 
         if with_docker is not None:
-            logging.info("Installing Docker...")
+            docker_cache_file = self.cache_path / f"docker-{self._docker_cache_key(with_docker)}.json"
+
+            if docker_cache_file.exists():
+                logging.info("Docker is already installed for this job; skipping installation.")
+            else:
+                logging.info("Installing Docker...")
+
+                with Path(".credentials").open("r") as file:
+                    credentials = safe_load(file)
 
-            with Path(".credentials").open("r") as file:
-                credentials = safe_load(file)
+                docker = en.Docker(agent=self.roles[with_docker],
+                                   bind_var_docker=self.bind_var_docker,
+                                   registry_opts=self.docker_registry,
+                                   credentials=credentials)
 
-            docker = en.Docker(agent=self.roles[with_docker],
-                               bind_var_docker=self.bind_var_docker,
-                               registry_opts=self.docker_registry,
-                               credentials=credentials)
+                docker.deploy()
 
-            docker.deploy()
+                docker_cache_file.parent.mkdir(parents=True, exist_ok=True)
+                docker_cache_file.write_text(json.dumps(self._docker_cache_spec(with_docker)))
 
             for role in self.roles[with_docker]:
                 logging.info(f"[{role.address}] Docker host is ready.")
 
         return self.roles, self.networks
 
+    def _docker_cache_spec(self, role: str):
+        return {
+            "jobs": sorted(f"{job.site}:{job.uid}" for job in self.provider.jobs),
+            "hosts": sorted(host.address for host in self.roles[role]),
+            "bind_var_docker": self.bind_var_docker,
+            "docker_registry": self.docker_registry
+        }
+
+    def _docker_cache_key(self, role: str):
+        spec = json.dumps(self._docker_cache_spec(role), sort_keys=True)
+        return hashlib.sha1(spec.encode()).hexdigest()
+
     def release(self):
         if self.provider is None:
             raise UndefinedProviderException
@@ -1,4 +1,6 @@
+import csv
 import logging
+import os
 import shutil
 import time
 from datetime import datetime
@@ -21,6 +23,11 @@ LOCAL_FILETREE = FileTree().define([
     {"path": f"@root/output", "tags": ["output"]},
 ])
 
+# Local configuration directories, resolved once
+CASSANDRA_CONF_PATH = LOCAL_FILETREE.path("cassandra-conf")
+DRIVER_CONF_PATH = LOCAL_FILETREE.path("driver-conf")
+WORKLOAD_CONF_PATH = LOCAL_FILETREE.path("workload-conf")
+
 DSTAT_SLEEP_IN_SEC = 5
 RUN_SLEEP_IN_SEC = 120  # 2 minutes
 FLUSH_SLEEP_IN_SEC = 900  # 15 minutes
@@ -28,18 +35,38 @@ WARMUP_DURATION_IN_SEC = 900  # 15 minutes
 
 MIN_RATE_LIMIT = 100.0
 
+# Placeholders for per-client cycle ranges in the main scenario
+READ_CYCLES_PLACEHOLDER = "{read_cycles}"
+WRITE_CYCLES_PLACEHOLDER = "{write_cycles}"
+
 
 class RateLimitFormatException(Exception):
     pass
 
 
+# Inferred rates, keyed by inference expression and results path
+_INFERRED_RATES: dict[tuple[str, str], float] = {}
+
+
+def infer_rate(expr: str, csv_input: CSVInput, basepath: Path):
+    """
+    Infer a rate from the results of a previous set, computing it only once per expression.
+    """
+
+    key = (expr, str(basepath))
+    if key not in _INFERRED_RATES:
+        _INFERRED_RATES[key] = Infer(csv_input, basepath).infer_from_expr(expr)
+
+    return _INFERRED_RATES[key]
+
+
 def get_rate_limiter(expr: str, csv_input: CSVInput, basepath: Path):
     if pd.isna(expr) or expr.startswith("none"):
         return "none", lambda run_index: 0.0
     elif expr.startswith("infer="):
         expr_args = expr.split("=")[1]
 
-        return "infer", lambda run_index: Infer(csv_input, basepath).infer_from_expr(expr_args)
+        return "infer", lambda run_index: infer_rate(expr_args, csv_input, basepath)
     elif expr.startswith("linear="):
         expr_args = expr.split("=")[1].split(",")
         start_rate, coeff_rate = float(expr_args[0]), float(expr_args[1])
@@ -54,6 +81,83 @@ def get_rate_limiter(expr: str, csv_input: CSVInput, basepath: Path):
         raise RateLimitFormatException
 
 
+def save_config_files(config_files: list[Path], dest_path: Path, saved_files: dict[Path, Path]):
+    """
+    Save configuration files of an experiment in `dest_path`.
+
+    Each file is only copied the first time it is saved; other experiments using the same file get a hard link to
+    that first copy. `saved_files` maps source files to their first copy.
+    """
+
+    for file_path in config_files:
+        path = dest_path / file_path.name
+
+        if file_path in saved_files:
+            try:
+                os.link(saved_files[file_path], path)
+                continue
+            except OSError:
+                pass
+
+        shutil.copy2(file_path, path)
+        saved_files.setdefault(file_path, path)
+
+
+def save_input_row(path: Path, index_label: str, _id: str, params: dict):
+    """
+    Save the input parameters of an experiment as a single-row CSV file, laid out like `DataFrame.to_csv`.
+    """
+
+    with path.open("w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow([index_label, *params.keys()])
+        writer.writerow([_id, *("" if pd.isna(value) else value for value in params.values())])
+
+
+def find_dstat_files(basepath: Path):
+    """
+    Find Dstat output files under `basepath`, walking directories with scandir (which avoids a stat per entry).
+    """
+
+    stack = [basepath]
+    while len(stack) > 0:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(Path(entry.path))
+                elif entry.name.endswith("-dstat.csv"):
+                    yield Path(entry.path)
+
+
+def wait_for_dstat(dstat: en.Dstat, timeout: int):
+    """
+    Wait until Dstat has started writing samples on every monitored node.
+
+    Polling is done on the nodes themselves, so that it only costs a single round-trip.
+    """
+
+    output_path = dstat.remote_working_dir / dstat.output_file
+
+    with en.actions(roles=dstat.nodes) as actions:
+        actions.shell(cmd=f"timeout {timeout} sh -c 'until [ -s {output_path} ]; do sleep 0.2; done'",
+                      ignore_errors=True)
+        results = actions.results
+
+    for result in results:
+        if result.payload.get("rc") != 0:
+            logging.warning(f"[{result.host}] Dstat is still not running after {timeout} seconds.")
+
+
+def teardown(cassandra: CassandraDriver, log_path: Path):
+    # Pull Cassandra logs
+    cassandra.pull_log(log_path)
+
+    # Shutdown and destroy
+    logging.info("Destroying instances.")
+
+    cassandra.destroy()
+
+
 def run(site: str,
         cluster: str,
         start_index: int,
@@ -62,20 +166,23 @@ def run(site: str,
         output_path: Path,
         report_interval: int,
         histogram_filter: str,
-        dstat_options="-Tcmdrns -D total,sda5"):
+        dstat_options="-Tcmdrns -D total,sda5",
+        client_dstat_options="-Tcn",
+        direct_pull=False):
     output_ft = FileTree().define([
         {"path": str(output_path), "tags": ["root"]},
         {"path": "@root/raw", "tags": ["raw"]},
     ]).build()
 
+    input_view = csv_input.view("input")
+
     csv_input.view().to_csv(output_ft.path("root") / "input.all.csv")
-    csv_input.view("input").to_csv(output_ft.path("root") / "input.csv")
+    input_view.to_csv(output_ft.path("root") / "input.csv")
 
     # Warning: the two following values must be wrapped in an int, as pandas returns an np.int64,
     # which is not usable in the resource driver.
 
-    max_hosts = int(csv_input.view(key="input", columns="hosts").max())
-    max_clients = int(csv_input.view(key="input", columns="clients").max())
+    max_hosts, max_clients = (int(value) for value in input_view[["hosts", "clients"]].max())
 
     # Acquire G5k resources.
     # We define two types of resources:
@@ -93,8 +200,26 @@ def run(site: str,
 
     resources.acquire(with_docker="nodes")
 
+    # First saved copy of each configuration file, to which later experiments are linked
+    saved_config_files: dict[Path, Path] = {}
+
+    # Deploy NoSQLBench once on every client: the image and remote directories do not change between experiments,
+    # only configuration files are shipped for each experiment
+    nb_all_hosts = list(resources.roles["clients"][:max_clients])
+
+    nb = NBDriver(docker_image="adugois1/nosqlbench:latest")
+    nb.deploy(nb_all_hosts)
+    nb.start_daemon()
+
+    nb_data_path = nb.filetree("remote_container").path("data")
+
     # Run experiments
-    for _id, params in csv_input.view("input").iterrows():
+    input_columns = list(input_view.columns)
+
+    # Rows are read as plain tuples rather than boxed into a Series (as iterrows does), and mapped to their columns
+    for _id, *values in input_view.itertuples(index=True, name=None):
+        params = dict(zip(input_columns, values))
+
         _name = params["name"]
         _repeat = params["repeat"]
         _hosts = params["hosts"]
@@ -141,44 +266,40 @@ def run(site: str,
         cassandra_hosts = list(resources.roles["cassandra"][:_hosts])
         nb_hosts = list(resources.roles["clients"][:_clients])
 
-        nb_driver_config_path = LOCAL_FILETREE.path("driver-conf") / _driver_config_file
-        nb_workload_config_path = LOCAL_FILETREE.path("workload-conf") / _workload_config_file
+        nb_driver_config_path = DRIVER_CONF_PATH / _driver_config_file
+        nb_workload_config_path = WORKLOAD_CONF_PATH / _workload_config_file
 
         # Save config files
         config_files = [
-            LOCAL_FILETREE.path("cassandra-conf") / _config_file,
-            LOCAL_FILETREE.path("cassandra-conf") / "jvm-server.options",
-            LOCAL_FILETREE.path("cassandra-conf") / "jvm11-server.options",
-            LOCAL_FILETREE.path("cassandra-conf") / "metrics-reporter-config.yaml",
-            LOCAL_FILETREE.path("driver-conf") / _driver_config_file,
-            LOCAL_FILETREE.path("workload-conf") / _workload_config_file
+            CASSANDRA_CONF_PATH / _config_file,
+            CASSANDRA_CONF_PATH / "jvm-server.options",
+            CASSANDRA_CONF_PATH / "jvm11-server.options",
+            CASSANDRA_CONF_PATH / "metrics-reporter-config.yaml",
+            DRIVER_CONF_PATH / _driver_config_file,
+            WORKLOAD_CONF_PATH / _workload_config_file
         ]
 
-        set_output_ft.copy(config_files, "conf")
+        save_config_files(config_files, set_output_ft.path("conf"), saved_config_files)
 
         # Save input parameters
         input_path = set_output_ft.path("root") / "input.csv"
-        csv_input.filter([_id]).to_csv(input_path)
+        save_input_row(input_path, input_view.index.name, _id, params)
 
-        # Deploy NoSQLBench
-        nb = NBDriver(docker_image="adugois1/nosqlbench:latest")
-
-        nb.deploy(nb_hosts)
-        nb.filetree("remote").copy([nb_driver_config_path], tag="driver-conf", remote=nb_hosts)
-        nb.filetree("remote").copy([nb_workload_config_path], tag="workload-conf", remote=nb_hosts)
+        # Use NoSQLBench on the clients of this experiment only
+        nb.set_hosts(nb_hosts)
+        nb.push_config(driver_config_paths=[nb_driver_config_path], workload_config_paths=[nb_workload_config_path])
 
         nb_driver_config = nb.filetree("remote_container").path("driver-conf") / nb_driver_config_path.name
         nb_workload_config = nb.filetree("remote_container").path("workload-conf") / nb_workload_config_path.name
-        nb_data_path = nb.filetree("remote_container").path("data")
 
         # Deploy and start Cassandra
         cassandra = CassandraDriver(docker_image=_docker_image)
 
         cassandra.init(cassandra_hosts, reset=True)
-        cassandra.create_config(LOCAL_FILETREE.path("cassandra-conf") / _config_file)
-        cassandra.create_extra_config([LOCAL_FILETREE.path("cassandra-conf") / "jvm-server.options",
-                                       LOCAL_FILETREE.path("cassandra-conf") / "jvm11-server.options",
-                                       LOCAL_FILETREE.path("cassandra-conf") / "metrics-reporter-config.yaml"])
+        cassandra.create_config(CASSANDRA_CONF_PATH / _config_file)
+        cassandra.create_extra_config([CASSANDRA_CONF_PATH / "jvm-server.options",
+                                       CASSANDRA_CONF_PATH / "jvm11-server.options",
+                                       CASSANDRA_CONF_PATH / "metrics-reporter-config.yaml"])
 
         cassandra.deploy().start().cleanup()
 
@@ -187,41 +308,51 @@ def run(site: str,
         # Rampup
         rampup_rate_limit = rampup_rate_limiter(1)
 
+        # Parameters shared by every NoSQLBench command of this experiment
+        nb_base_params = {
+            "driver": "cqld4",
+            "driverconfig": nb_driver_config,
+            "workload": nb_workload_config,
+            "localdc": "datacenter1"
+        }
+
+        rampup_params = {
+            "alias": "rampup",
+            **nb_base_params,
+            "tags": "block:rampup",
+            "threads": "auto",
+            "cycles": f"1..{int(_keys) + 1}",
+            "stride": 1000,
+            "errors": "warn,retry",
+            "host": cassandra.get_host_address(0),
+            "keysize": int(_key_size),
+            "valuesizedist": f"'{_value_size_dist}'"
+        }
+
         logging.info("Executing rampup phase.")
-        logging.info(f"Rate: {rampup_rate_limit} ops/second.")
         logging.info(f"Ops: {_keys} ops.")
-        logging.info(f"Total duration: {_keys / rampup_rate_limit} seconds.")
+
+        # Without rate limit (none), the rampup goes as fast as the cluster absorbs writes
+        if rampup_rate_limit > 0:
+            rampup_params["cyclerate"] = rampup_rate_limit
+
+            logging.info(f"Rate: {rampup_rate_limit} ops/second.")
+            logging.info(f"Total duration: {_keys / rampup_rate_limit} seconds.")
+        else:
+            logging.info("Rate: unlimited.")
 
         nb.command(
             Scenario.create(
                 RunCommand.create(**{
                     "alias": "schema",
-                    "driver": "cqld4",
-                    "driverconfig": nb_driver_config,
-                    "workload": nb_workload_config,
+                    **nb_base_params,
                     "tags": "block:schema",
                     "threads": 1,
                     "errors": "warn,retry",
                     "host": cassandra.get_host_address(0),
-                    "localdc": "datacenter1",
                     "rf": int(_rf)
                 }),
-                RunCommand.create(**{
-                    "alias": "rampup",
-                    "driver": "cqld4",
-                    "driverconfig": nb_driver_config,
-                    "workload": nb_workload_config,
-                    "tags": "block:rampup",
-                    "threads": "auto",
-                    "cyclerate": rampup_rate_limit,
-                    "cycles": f"1..{int(_keys) + 1}",
-                    "stride": 1000,
-                    "errors": "warn,retry",
-                    "host": cassandra.get_host_address(0),
-                    "localdc": "datacenter1",
-                    "keysize": int(_key_size),
-                    "valuesizedist": f"'{_value_size_dist}'"
-                })
+                RunCommand.create(**rampup_params)
             )
             .as_string()
         )
@@ -233,16 +364,60 @@ def run(site: str,
 
         logging.info("Waiting for compaction...")
 
-        time.sleep(FLUSH_SLEEP_IN_SEC)
-
-        logging.info(cassandra.tablestats("baselines", "keyvalue"))
+        # Flush sleep is an upper bound: go on as soon as no compaction is pending or running on any node
+        cassandra.wait_for_compactions(timeout=FLUSH_SLEEP_IN_SEC)
+
+        logging.info(cassandra.diagnostics("baselines", "keyvalue"))
+
+        # Read/write split and main phase parameters do not depend on the run
+        rw_total = _read_ratio + _write_ratio
+        read_ratio = _read_ratio / rw_total
+        write_ratio = _write_ratio / rw_total
+
+        read_threads = int(read_ratio * _client_threads)
+        write_threads = int(write_ratio * _client_threads)
+
+        cycle_per_stride = int(_cycle_per_stride)
+
+        host_addresses = cassandra.get_host_addresses()
+
+        read_base_params = {
+            "alias": "read",
+            **nb_base_params,
+            "tags": "block:main-read",
+            "threads": read_threads,
+            "stride": cycle_per_stride,
+            "hdr_digits": 5,
+            "errors": "warn,timer",
+            "host": host_addresses,
+            "keycount": int(_keys),
+            "keydist": f"'{_key_dist}'",
+            "keysize": int(_key_size),
+            "valuesizedist": f"'{_value_size_dist}'"
+        }
+
+        write_base_params = {
+            "alias": "write",
+            **nb_base_params,
+            "tags": "block:main-write",
+            "threads": write_threads,
+            "stride": cycle_per_stride,
+            "hdr_digits": 5,
+            "errors": "warn,timer",
+            "host": host_addresses,
+            "keycount": int(_keys),
+            "keydist": f"'{_key_dist}'",
+            "keysize": int(_key_size),
+            "valuesizedist": f"'{_value_size_dist}'"
+        }
 
         # The very first run (index 0) is a warmup phase.
         # That's why we have one additional iteration here.
         for run_index in range(_repeat + 1):
             logging.info(f"Waiting for the system before running run {run_index}...")
 
-            time.sleep(RUN_SLEEP_IN_SEC)
+            # Rather than always resting for the worst case, go on as soon as nodes are done compacting
+            cassandra.wait_for_compactions(timeout=RUN_SLEEP_IN_SEC)
 
             logging.info(f"Running {_name}#{_id} - run {run_index}.")
 
@@ -268,53 +443,12 @@ def run(site: str,
                 else:
                     ops_per_client = _duration * main_rate_limit_per_client
 
-            rw_total = _read_ratio + _write_ratio
-            read_ratio = _read_ratio / rw_total
-            write_ratio = _write_ratio / rw_total
-
             read_ops_per_client = int(read_ratio * ops_per_client)
             write_ops_per_client = int(write_ratio * ops_per_client)
 
-            read_threads = int(read_ratio * _client_threads)
-            write_threads = int(write_ratio * _client_threads)
-
-            cycle_per_stride = int(_cycle_per_stride)
-
-            read_params = {
-                "alias": "read",
-                "driver": "cqld4",
-                "driverconfig": nb_driver_config,
-                "workload": nb_workload_config,
-                "tags": "block:main-read",
-                "threads": read_threads,
-                "stride": cycle_per_stride,
-                "hdr_digits": 5,
-                "errors": "warn,timer",
-                "host": cassandra.get_host_addresses(),
-                "localdc": "datacenter1",
-                "keycount": int(_keys),
-                "keydist": f"'{_key_dist}'",
-                "keysize": int(_key_size),
-                "valuesizedist": f"'{_value_size_dist}'"
-            }
-
-            write_params = {
-                "alias": "write",
-                "driver": "cqld4",
-                "driverconfig": nb_driver_config,
-                "workload": nb_workload_config,
-                "tags": "block:main-write",
-                "threads": write_threads,
-                "stride": cycle_per_stride,
-                "hdr_digits": 5,
-                "errors": "warn,timer",
-                "host": cassandra.get_host_addresses(),
-                "localdc": "datacenter1",
-                "keycount": int(_keys),
-                "keydist": f"'{_key_dist}'",
-                "keysize": int(_key_size),
-                "valuesizedist": f"'{_value_size_dist}'"
-            }
+            # Striderate is set per run on copies of the base parameters
+            read_params = dict(read_base_params)
+            write_params = dict(write_base_params)
 
             if main_rate_limit_per_client >= MIN_RATE_LIMIT:
                 main_duration = read_ops_per_client / main_rate_limit_per_client
@@ -332,47 +466,54 @@ def run(site: str,
                 logging.info(f"Ops/client: {read_ops_per_client} ops.")
                 logging.info(f"Total expected duration: {main_duration:.3f} seconds.")
 
-            main_cmds = []
-            for index, host in enumerate(nb.hosts):
-                read_start = int(index * read_ops_per_client)
-                read_end = int(read_start + read_ops_per_client)
-                read_cycles = f"{read_start}..{read_end}"
-
-                write_start = int(index * write_ops_per_client)
-                write_end = int(write_start + write_ops_per_client)
-                write_cycles = f"{write_start}..{write_end}"
-
-                if _write_ratio > 0:
-                    commands = [
-                        StartCommand.create(**read_params, cycles=read_cycles),
-                        StartCommand.create(**write_params, cycles=write_cycles),
-                        AwaitCommand.create("read"),
-                        StopCommand.create("write")
-                    ]
-                else:
-                    commands = [
-                        StartCommand.create(**read_params, cycles=read_cycles),
-                        AwaitCommand.create("read")
-                    ]
-
-                main_cmds.append((
-                    host,
-                    Scenario.create(*commands)
-                    .logs_dir(nb_data_path)
-                    .log_histostats(nb_data_path / f"histostats.csv:{histogram_filter}")
-                    .log_histograms(nb_data_path / f"histograms.csv:{histogram_filter}")
-                    .report_summary_to(nb_data_path / "summary.txt")
-                    .report_csv_to(nb_data_path / "csv")
-                    .report_interval(report_interval)
-                    .as_string()
-                ))
+            # Each client runs its own contiguous range of cycles
+            client_indexes = range(nb.host_count)
+            read_cycles_per_client = [f"{index * read_ops_per_client}..{(index + 1) * read_ops_per_client}"
+                                      for index in client_indexes]
+            write_cycles_per_client = [f"{index * write_ops_per_client}..{(index + 1) * write_ops_per_client}"
+                                       for index in client_indexes]
+
+            # Only cycles differ between clients: the scenario is built once with placeholders, which are then
+            # replaced for each client
+            if _write_ratio > 0:
+                commands = [
+                    StartCommand.create(**read_params, cycles=READ_CYCLES_PLACEHOLDER),
+                    StartCommand.create(**write_params, cycles=WRITE_CYCLES_PLACEHOLDER),
+                    AwaitCommand.create("read"),
+                    StopCommand.create("write")
+                ]
+            else:
+                commands = [
+                    StartCommand.create(**read_params, cycles=READ_CYCLES_PLACEHOLDER),
+                    AwaitCommand.create("read")
+                ]
+
+            main_scenario = (
+                Scenario.create(*commands)
+                .logs_dir(nb_data_path)
+                .log_histostats(nb_data_path / f"histostats.csv:{histogram_filter}")
+                .log_histograms(nb_data_path / f"histograms.csv:{histogram_filter}")
+                .report_summary_to(nb_data_path / "summary.txt")
+                .report_csv_to(nb_data_path / "csv")
+                .report_interval(report_interval)
+                .as_string()
+            )
+
+            main_cmds = [
+                (host, main_scenario.replace(READ_CYCLES_PLACEHOLDER, read_cycles)
+                                    .replace(WRITE_CYCLES_PLACEHOLDER, write_cycles))
+                for host, read_cycles, write_cycles in zip(nb.hosts, read_cycles_per_client, write_cycles_per_client)
+            ]
 
             _tmp_dstat_path = run_output_ft.path("dstat")
             _tmp_data_path = run_output_ft.path("data")
 
-            with en.Dstat(nodes=[*cassandra.hosts, *nb.hosts], options=dstat_options, backup_dir=_tmp_dstat_path):
+            # Clients are only monitored for CPU and network, which keeps the sidecar cheap next to NoSQLBench
+            with en.Dstat(nodes=cassandra.hosts, options=dstat_options, backup_dir=_tmp_dstat_path) as host_dstat, \
+                    en.Dstat(nodes=nb.hosts, options=client_dstat_options, backup_dir=_tmp_dstat_path) as client_dstat:
                 # Make sure Dstat is running when we start experiment
-                time.sleep(DSTAT_SLEEP_IN_SEC)
+                wait_for_dstat(host_dstat, timeout=DSTAT_SLEEP_IN_SEC)
+                wait_for_dstat(client_dstat, timeout=DSTAT_SLEEP_IN_SEC)
 
                 # Launch main commands
                 nb.commands(main_cmds)
@@ -381,9 +522,10 @@ def run(site: str,
                 time.sleep(DSTAT_SLEEP_IN_SEC)
 
             # Get NoSQLBench results
-            nb.pull_results(_tmp_data_path)
+            nb.pull_results(_tmp_data_path, direct=direct_pull)
 
-            # Save results
+            # Save results. Temporary files are moved rather than copied: they live on the same file system, and the
+            # temporary directory is removed afterwards anyway.
             _client_path = run_output_ft.path("clients")
             _host_path = run_output_ft.path("hosts")
 
@@ -393,14 +535,15 @@ def run(site: str,
                     _client_dstat_path = _client_path / client.address / "dstat"
                     _client_dstat_path.mkdir(parents=True, exist_ok=True)
 
-                    for _dstat_file in _dstat_dir.glob("**/*-dstat.csv"):
-                        shutil.copy2(_dstat_file, _client_dstat_path / _dstat_file.name)
+                    for _dstat_file in find_dstat_files(_dstat_dir):
+                        _dstat_file.replace(_client_dstat_path / _dstat_file.name)
                 else:
                     logging.warning(f"{_dstat_dir} does not exist.")
 
                 _data_dir = _tmp_data_path / client.address / "data"
                 if _data_dir.exists():
-                    shutil.copytree(_data_dir, _client_path / client.address / "data")
+                    (_client_path / client.address).mkdir(parents=True, exist_ok=True)
+                    _data_dir.rename(_client_path / client.address / "data")
                 else:
                     logging.warning(f"{_data_dir} does not exist.")
 
@@ -410,22 +553,17 @@ def run(site: str,
                     _host_dstat_path = _host_path / host.address / "dstat"
                     _host_dstat_path.mkdir(parents=True, exist_ok=True)
 
-                    for _dstat_file in _dstat_dir.glob("**/*-dstat.csv"):
-                        shutil.copy2(_dstat_file, _host_dstat_path / _dstat_file.name)
+                    for _dstat_file in find_dstat_files(_dstat_dir):
+                        _dstat_file.replace(_host_dstat_path / _dstat_file.name)
                 else:
                     logging.warning(f"{_dstat_dir} does not exist.")
 
             run_output_ft.remove("tmp")
 
-        # Pull Cassandra logs
-        cassandra.pull_log(set_output_ft.path("data"))
-
-        # Shutdown and destroy
-        logging.info("Destroying instances.")
-
-        nb.destroy()
+        teardown(cassandra, set_output_ft.path("data"))
 
-        cassandra.destroy()
+    nb.set_hosts(nb_all_hosts)
+    nb.destroy()
 
     # Release resources
     resources.release()
@@ -445,6 +583,8 @@ if __name__ == "__main__":
     DEFAULT_WALLTIME = "00:30:00"
     DEFAULT_REPORT_INTERVAL = 1
     DEFAULT_HISTOGRAM_FILTER = f"read.(result-success|stretch|small-latency|large-latency):{DEFAULT_REPORT_INTERVAL}s"
+    DEFAULT_DSTAT_OPTIONS = "-Tcmdrns -D total,sda5"
+    DEFAULT_CLIENT_DSTAT_OPTIONS = "-Tcn"
 
     set_config(ansible_stdout="noop")
 
@@ -465,6 +605,9 @@ if __name__ == "__main__":
     parser.add_argument("--from-id", type=str, default=None)
     parser.add_argument("--to-id", type=str, default=None)
     parser.add_argument("--log", type=str, default=None)
+    parser.add_argument("--dstat-options", type=str, default=DEFAULT_DSTAT_OPTIONS)
+    parser.add_argument("--client-dstat-options", type=str, default=DEFAULT_CLIENT_DSTAT_OPTIONS)
+    parser.add_argument("--direct-pull", action="store_true")
 
     args = parser.parse_args()
 
@@ -492,4 +635,6 @@ if __name__ == "__main__":
     logging.basicConfig(**log_options)
 
     run(site=args.site, cluster=args.cluster, start_index=args.start_index, settings=settings, csv_input=csv_input,
-        output_path=output_path, report_interval=args.report_interval, histogram_filter=args.histogram_filter)
+        output_path=output_path, report_interval=args.report_interval, histogram_filter=args.histogram_filter,
+        dstat_options=args.dstat_options, client_dstat_options=args.client_dstat_options,
+        direct_pull=args.direct_pull)
@@ -110,13 +110,15 @@ class FileTree:
         return self
 
     def build(self, remote: Optional[list[en.Host]] = None):
+        # Only leaf paths are created: their parents are created along with them, so the other paths do not need
+        # their own mkdir (or their own iteration)
         if remote is None:
-            for path in self.iterpaths():
+            for path in self.leaves():
                 path.mkdir(mode=0o777, parents=True, exist_ok=True)
         else:
             with en.actions(roles=remote) as actions:
-                for path in self.iterpaths():
-                    actions.file(path=str(path), state="directory", mode=0o777)
+                actions.file(path="{{item}}", state="directory", mode=0o777,
+                             loop=[str(path) for path in self.leaves()])
 
         return self
 
@@ -126,7 +128,7 @@ class FileTree:
                 for file_path in file_paths:
                     shutil.copy2(file_path, path)
         else:
-            with en.actions(roles=remote) as actions:
+            with en.actions(roles=remote, strategy="free") as actions:
                 for path in self.iterpaths(tag):
                     for file_path in file_paths:
                         actions.copy(src=str(file_path), dest=str(path))
@@ -138,7 +140,7 @@ class FileTree:
             for path in self.iterpaths(tag):
                 shutil.rmtree(path)
         else:
-            with en.actions(roles=remote) as actions:
+            with en.actions(roles=remote, strategy="free") as actions:
                 for path in self.iterpaths(tag):
                     actions.file(path=str(path), state="absent")
 
@@ -153,6 +155,16 @@ class FileTree:
             for path in self.tree[tag]:
                 yield path
 
+    def leaves(self):
+        """
+        Return the paths of the tree that are not a parent of another path of the tree.
+        """
+
+        paths = list(dict.fromkeys(self.iterpaths()))
+        parents = {parent for path in paths for parent in path.parents}
+
+        return [path for path in paths if path not in parents]
+
     def paths(self, tag: str):
         if tag in self.tree:
             return self.tree[tag]